@@ -0,0 +1,174 @@
+import csv
+import io
+import json
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from components import data_store
+from components.utils import atomic_write_bytes
+
+WATERMARKS_PATH = data_store.DATA_DIR / "feed_watermarks.json"
+
+FEED_HEADERS = [
+    "change", "guest_id", "invite_label", "full_name", "is_child",
+    "attending", "meal_choice", "meal_label", "allergies", "notes", "updated_at",
+]
+
+# Watermark di un consumatore:
+#   - rsvps_updated_at: updated_at più recente già esportato (le rsvps hanno un timestamp)
+#   - guests_seq: numero di righe di guests già viste (guests è solo append, senza updated_at)
+Watermark = Dict[str, Any]
+EMPTY_WATERMARK: Watermark = {"rsvps_updated_at": "", "guests_seq": 0}
+
+_lock = threading.Lock()
+_index_cache: Dict[str, Any] = {"signature": None, "index": None}
+
+
+class ChangeIndex:
+    """
+    Indice delle modifiche, ricostruito solo quando cambiano i dati (vedi data_signature):
+    rsvps ordinate per updated_at (ricerca binaria sul watermark) e guests in ordine di foglio.
+    Il delta non è O(modifiche): ogni chiamata copia i dati dalla cache e ne calcola la
+    firma (O(n)); l'indice evita solo l'ordinamento e la costruzione delle righe non cambiate.
+    Con fresh=True (CLI) si scarica tutto da Sheets e l'indice si ricostruisce.
+    """
+
+    def __init__(self, data: data_store.AllData):
+        invites, guests, rsvps, meals = data
+        ordered = sorted((r for r in rsvps if r.get("updated_at")), key=lambda r: str(r["updated_at"]))
+        self._rsvp_ts = [str(r["updated_at"]) for r in ordered]
+        self._rsvps = ordered
+        self._guests = guests
+        self._guests_by_id = {g["id"]: g for g in guests}
+        self._rsvps_by_guest = {r["guest_id"]: r for r in rsvps}
+        self._invite_labels = {i["id"]: i.get("label") or "" for i in invites}
+        self._meal_labels = {m["code"]: m["label"] for m in meals}
+
+    def rsvps_between(self, after: str, before: Optional[str] = None) -> List[Dict[str, Any]]:
+        """rsvps con after < updated_at < before (before=None: nessun limite superiore)."""
+        lo = bisect_right(self._rsvp_ts, after)
+        hi = bisect_left(self._rsvp_ts, before) if before else len(self._rsvp_ts)
+        return self._rsvps[lo:hi]
+
+    def guests_since(self, seq: int) -> List[Dict[str, Any]]:
+        return self._guests[seq:]
+
+    @property
+    def guests_count(self) -> int:
+        return len(self._guests)
+
+    def feed_row(self, change: str, guest_id: str) -> Dict[str, Any]:
+        g = self._guests_by_id.get(guest_id, {})
+        r = self._rsvps_by_guest.get(guest_id, {})
+        return {
+            "change": change,
+            "guest_id": guest_id,
+            "invite_label": self._invite_labels.get(g.get("invite_id"), ""),
+            "full_name": g.get("full_name", ""),
+            "is_child": g.get("is_child", False),
+            "attending": r.get("attending"),
+            "meal_choice": r.get("meal_choice"),
+            "meal_label": self._meal_labels.get(r.get("meal_choice"), ""),
+            "allergies": r.get("allergies"),
+            "notes": r.get("notes"),
+            "updated_at": r.get("updated_at", ""),
+        }
+
+
+def data_signature(data: data_store.AllData) -> Tuple[Any, ...]:
+    """
+    Firma dei dati passati: cambia solo se cambiano le righe che finiscono nel feed
+    (numero di rsvps e updated_at più recente, ospiti, label di inviti e menù).
+    """
+    invites, guests, rsvps, meals = data
+    return (
+        len(rsvps),
+        max((str(r.get("updated_at") or "") for r in rsvps), default=""),
+        hash(tuple((g["id"], g.get("invite_id"), g.get("full_name"), g.get("is_child")) for g in guests)),
+        hash(tuple((i["id"], i.get("label") or "") for i in invites)),
+        hash(tuple((m["code"], m["label"]) for m in meals)),
+    )
+
+
+def _get_index(data: data_store.AllData) -> ChangeIndex:
+    signature = data_signature(data)
+    with _lock:
+        if _index_cache["signature"] != signature:
+            _index_cache["index"] = ChangeIndex(data)
+            _index_cache["signature"] = signature
+        return _index_cache["index"]
+
+
+def changes_since(watermark: Optional[Watermark] = None, fresh: bool = False) -> Tuple[List[Dict[str, Any]], Watermark]:
+    """
+    Righe cambiate dopo il watermark e il nuovo watermark da salvare dopo l'export.
+
+    Le RSVP ancora nella coda di scrittura hanno un updated_at già assegnato ma non sono
+    ancora su Sheets: il delta si ferma prima della più vecchia, così il watermark non la
+    scavalca e la modifica arriva nel delta successivo. Le scritture scartate non
+    contano: quando vengono riaccodate ricevono un updated_at nuovo
+    (data_store.retry_failed_write), quindi finiscono comunque sopra il watermark.
+    """
+    wm = {**EMPTY_WATERMARK, **(watermark or {})}
+    index = _get_index(data_store.load_confirmed_data(fresh=fresh))
+
+    pending_ts = [
+        str(p["payload"].get("updated_at") or "")
+        for p in data_store.pending_writes()
+        if p["worksheet"] == "rsvps"
+    ]
+    before = min(pending_ts) if pending_ts else None
+
+    rows: Dict[str, Dict[str, Any]] = {}
+    for g in index.guests_since(int(wm["guests_seq"])):
+        rows[g["id"]] = index.feed_row("new_guest", g["id"])
+    changed = index.rsvps_between(str(wm["rsvps_updated_at"]), before)
+    for r in changed:
+        rows.setdefault(r["guest_id"], index.feed_row("rsvp", r["guest_id"]))
+
+    new_wm = {
+        "rsvps_updated_at": str(changed[-1]["updated_at"]) if changed else wm["rsvps_updated_at"],
+        "guests_seq": index.guests_count,
+    }
+    return list(rows.values()), new_wm
+
+
+def to_csv_bytes(rows: List[Dict[str, Any]]) -> bytes:
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=FEED_HEADERS)
+    writer.writeheader()
+    writer.writerows(rows)
+    return buf.getvalue().encode("utf-8")
+
+
+# -----------------------------
+# Watermark per consumatore (catering, location, ...)
+# -----------------------------
+def load_watermarks() -> Dict[str, Watermark]:
+    try:
+        with open(WATERMARKS_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def get_watermark(consumer: str) -> Watermark:
+    return {**EMPTY_WATERMARK, **load_watermarks().get(consumer, {})}
+
+
+def commit_watermark(consumer: str, watermark: Watermark) -> None:
+    """Salva il watermark del consumatore: da chiamare solo dopo che l'export è stato consegnato."""
+    with _lock:
+        marks = load_watermarks()
+        marks[consumer] = {**watermark, "committed_at": datetime.utcnow().isoformat()}
+        atomic_write_bytes(WATERMARKS_PATH, json.dumps(marks, ensure_ascii=False, indent=2).encode("utf-8"))
+
+
+def reset_watermark(consumer: str) -> None:
+    """Il prossimo delta del consumatore sarà di nuovo un export completo."""
+    with _lock:
+        marks = load_watermarks()
+        if marks.pop(consumer, None) is not None:
+            atomic_write_bytes(WATERMARKS_PATH, json.dumps(marks, ensure_ascii=False, indent=2).encode("utf-8"))
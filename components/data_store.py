@@ -1,10 +1,18 @@
+import os
+import pickle
+import threading
 import uuid
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Tuple
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 
-import gspread
 import streamlit as st
-from google.oauth2.service_account import Credentials
+
+from components.utils import atomic_write_bytes
+from components.write_queue import WriteQueue, default_is_transient
+
+if TYPE_CHECKING:  # gspread/google-auth si importano solo quando serve parlare con Sheets
+    import gspread
 
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
 
@@ -13,6 +21,19 @@ GUESTS_HEADERS = ["id", "invite_id", "full_name", "is_child"]
 RSVPS_HEADERS = ["guest_id", "attending", "meal_choice", "allergies", "notes", "updated_at"]
 MEAL_HEADERS = ["code", "label", "active"]
 
+# Cartella locale per snapshot e scritture in attesa (non va committata)
+DATA_DIR = Path(os.environ.get("WEDDING_DATA_DIR", ".data"))
+SNAPSHOT_PATH = DATA_DIR / "snapshot.pkl"
+QUEUE_PATH = DATA_DIR / "write_queue.sqlite3"
+SNAPSHOT_VERSION = 1
+
+AllData = Tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[Dict[str, Any]], List[Dict[str, Any]]]
+
+# Stato del backend condiviso da tutte le sessioni del processo
+_backend = {"degraded": False, "error": None, "snapshot_at": None, "cold_start": True}
+_io_lock = threading.Lock()
+_revalidate_lock = threading.Lock()
+
 
 def _to_bool(val: Any) -> bool:
     if isinstance(val, bool):
@@ -47,27 +68,131 @@ def _get_spreadsheet():
     info = st.secrets["gcp_service_account"]
     sheet_id = st.secrets["GSPREAD_SHEET_ID"]
 
+    import gspread
+    from google.oauth2.service_account import Credentials
+
     creds = Credentials.from_service_account_info(info, scopes=SCOPES)
     client = gspread.authorize(creds)
     return client.open_by_key(sheet_id)
 
 
-def _worksheet_and_rows(name: str) -> Tuple[gspread.Worksheet, List[Dict[str, Any]]]:
+def _worksheet_and_rows(name: str) -> Tuple["gspread.Worksheet", List[Dict[str, Any]]]:
     ws = _get_spreadsheet().worksheet(name)
     return ws, ws.get_all_records()
 
 
+# -----------------------------
+# Snapshot su disco
+# -----------------------------
+def _save_snapshot(data: AllData) -> None:
+    now = datetime.utcnow().isoformat()
+    payload = pickle.dumps(
+        {"version": SNAPSHOT_VERSION, "saved_at": now, "data": data},
+        protocol=pickle.HIGHEST_PROTOCOL,
+    )
+    with _io_lock:
+        atomic_write_bytes(SNAPSHOT_PATH, payload)
+    _backend["snapshot_at"] = now
+
+
+def _load_snapshot() -> Optional[AllData]:
+    """Ultimo snapshot valido salvato su disco, oppure None."""
+    try:
+        with open(SNAPSHOT_PATH, "rb") as f:
+            snap = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+        return None
+    if not isinstance(snap, dict) or snap.get("version") != SNAPSHOT_VERSION:
+        return None
+    _backend["snapshot_at"] = snap.get("saved_at")
+    return snap["data"]
+
+
+def _fetch_all() -> AllData:
+    """Scarica i quattro worksheet da Sheets e aggiorna lo snapshot su disco."""
+    data = (load_invites(), load_guests(), load_rsvps(), load_meal_options())
+    _backend["degraded"] = False
+    _backend["error"] = None
+    _save_snapshot(data)
+    return data
+
+
+def _revalidate_in_background() -> None:
+    def run():
+        if not _revalidate_lock.acquire(blocking=False):
+            return
+        try:
+            _fetch_all()
+            refresh_cache()
+        except Exception as e:  # backend irraggiungibile: si resta sullo snapshot
+            _backend["degraded"] = True
+            _backend["error"] = str(e)
+        finally:
+            _revalidate_lock.release()
+
+    threading.Thread(target=run, name="sheets-revalidate", daemon=True).start()
+
+
 @st.cache_data(ttl=30)
-def load_all_data() -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[Dict[str, Any]], List[Dict[str, Any]]]:
-    invites = load_invites()
-    guests = load_guests()
-    rsvps = load_rsvps()
-    meals = load_meal_options()
-    return invites, guests, rsvps, meals
+def _load_all_data_cached() -> AllData:
+    if _backend["cold_start"]:
+        _backend["cold_start"] = False
+        snap = _load_snapshot()
+        if snap is not None:
+            _revalidate_in_background()
+            return snap
+
+    try:
+        return _fetch_all()
+    except Exception as e:
+        snap = _load_snapshot()
+        if snap is None:
+            raise
+        _backend["degraded"] = True
+        _backend["error"] = str(e)
+        return snap
+
+
+def load_confirmed_data(fresh: bool = False) -> AllData:
+    """
+    Dati così come sono su Sheets, senza le scritture ancora in coda.
+    Con fresh=True scarica subito da Sheets (niente cache/snapshot, solleva se giù).
+    """
+    if fresh:
+        return _fetch_all()
+    return _load_all_data_cached()
+
+
+def load_all_data() -> AllData:
+    """
+    Restituisce (invites, guests, rsvps, meals).
+    - Al primo avvio del processo usa lo snapshot su disco (se c'è) e lo
+      rivalida in background.
+    - Se Google Sheets non risponde, serve lo snapshot in sola lettura
+      (vedi is_degraded()).
+    - Sopra ai dati in cache applica le scritture ancora in coda, così chi ha
+      appena salvato vede subito la propria risposta.
+    """
+    _get_queue().start()  # nel processo web il worker parte col primo caricamento dati
+    return _apply_pending(_load_all_data_cached())
+
+
+def is_degraded() -> bool:
+    """True se i dati arrivano dallo snapshot locale perché Sheets non risponde."""
+    return bool(_backend["degraded"])
+
+
+def backend_status() -> Dict[str, Any]:
+    return {
+        "degraded": _backend["degraded"],
+        "error": _backend["error"],
+        "snapshot_at": _backend["snapshot_at"],
+        "pending_writes": _get_queue().stats()["depth"],
+    }
 
 
 def refresh_cache():
-    load_all_data.clear()
+    _load_all_data_cached.clear()
 
 
 def load_invites() -> List[Dict[str, Any]]:
@@ -184,26 +309,175 @@ def find_invite_by_label(label: str) -> Optional[Dict[str, Any]]:
 
 
 def upsert_rsvp(row: Dict[str, Any]) -> None:
-    ws, rows = _worksheet_and_rows("rsvps")
-    idx = _find_row_index(rows, "guest_id", row["guest_id"])
-    now = datetime.utcnow().isoformat()
+    """Accoda la RSVP e ritorna subito: l'invio a Sheets lo fa il worker della coda."""
+    row = {**row, "updated_at": row.get("updated_at") or datetime.utcnow().isoformat()}
+    _get_queue().enqueue("rsvps", row["guest_id"], row)
+
+
+def add_guest(invite_id: str, full_name: str, is_child: bool = False) -> Dict[str, Any]:
+    guest = {"id": str(uuid.uuid4()), "invite_id": invite_id, "full_name": full_name, "is_child": is_child}
+    _get_queue().enqueue("guests", guest["id"], guest)
+    return guest
+
+
+# -----------------------------
+# Coda di scritture (write-behind)
+# -----------------------------
+class SheetsUnavailable(Exception):
+    """Il foglio non si apre (secrets, credenziali, foglio/worksheet mancante): non è colpa del lotto."""
+
+
+def _open_for_write(name: str) -> Tuple["gspread.Worksheet", List[Dict[str, Any]]]:
+    try:
+        return _worksheet_and_rows(name)
+    except Exception as e:
+        raise SheetsUnavailable(f"{name}: {type(e).__name__}: {e}") from e
+
+
+def _write_rsvps_batch(batch: List[Dict[str, Any]]) -> None:
+    """Una lettura + un batch_update + un append_rows per tutto il lotto."""
+    ws, rows = _open_for_write("rsvps")
+    index = {str(r.get("guest_id") or ""): idx for idx, r in enumerate(rows, start=2)}
+    updates, appends = [], []
+    for row in batch:
+        values = [
+            row["guest_id"],
+            row.get("attending"),
+            row.get("meal_choice"),
+            row.get("allergies"),
+            row.get("notes"),
+            row.get("updated_at") or datetime.utcnow().isoformat(),
+        ]
+        idx = index.get(row["guest_id"])
+        if idx:
+            updates.append({"range": f"A{idx}:F{idx}", "values": [values]})
+        else:
+            appends.append(values)
+    if updates:
+        ws.batch_update(updates)
+    if appends:
+        ws.append_rows(appends, value_input_option="USER_ENTERED")
+
+
+def _write_guests_batch(batch: List[Dict[str, Any]]) -> None:
+    # Idempotente: dopo un tentativo fallito a metà non duplica gli ospiti già scritti
+    ws, rows = _open_for_write("guests")
+    existing = {str(r.get("id") or "") for r in rows}
     values = [
-        row["guest_id"],
-        row.get("attending"),
-        row.get("meal_choice"),
-        row.get("allergies"),
-        row.get("notes"),
-        now,
+        [g["id"], g["invite_id"], g["full_name"], g["is_child"]]
+        for g in batch
+        if g["id"] not in existing
     ]
-    if idx:
-        ws.update(f"A{idx}:F{idx}", [values])
-    else:
-        ws.append_row(values, value_input_option="USER_ENTERED")
+    if values:
+        ws.append_rows(values, value_input_option="USER_ENTERED")
 
 
-def add_guest(invite_id: str, full_name: str, is_child: bool = False) -> Dict[str, Any]:
-    ws, _ = _worksheet_and_rows("guests")
-    guest_id = str(uuid.uuid4())
-    values = [guest_id, invite_id, full_name, is_child]
-    ws.append_row(values, value_input_option="USER_ENTERED")
-    return {"id": guest_id, "invite_id": invite_id, "full_name": full_name, "is_child": is_child}
+def _is_transient_error(error: Exception) -> bool:
+    """
+    Errori del backend, si riprova senza dead letter: rete giù, quota (429), errore lato
+    Google (5xx), accesso/foglio (401/403/404), google-auth (TransportError, RefreshError)
+    e foglio che non si apre. Il resto è un dato non valido o un bug.
+    """
+    if isinstance(error, SheetsUnavailable):
+        return True
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status in (401, 403, 404, 429) or status >= 500
+    try:
+        from google.auth.exceptions import GoogleAuthError  # già caricato se si è parlato con Sheets
+    except ImportError:
+        GoogleAuthError = ()
+    return isinstance(error, GoogleAuthError) or default_is_transient(error)
+
+
+def _mark_write_failure(error: Exception) -> None:
+    if not _is_transient_error(error):
+        return  # riga non valida: finisce in dead letter, il backend non è giù
+    _backend["degraded"] = True
+    _backend["error"] = str(error)
+
+
+@st.cache_resource
+def _get_queue() -> WriteQueue:
+    """
+    Coda durevole (SQLite) condivisa dal processo. Il worker non parte qui: lo avviano
+    load_all_data() ed enqueue(), così gli script CLI che leggono soltanto (pending_writes)
+    non svuotano la stessa coda in parallelo al sito.
+    """
+    queue = WriteQueue(
+        QUEUE_PATH,
+        handlers={"guests": _write_guests_batch, "rsvps": _write_rsvps_batch},
+        on_success=refresh_cache,
+        on_error=_mark_write_failure,
+        is_transient=_is_transient_error,
+    )
+    return queue
+
+
+def _apply_pending(data: AllData) -> AllData:
+    """Sovrappone ai dati le scritture in coda, così l'invitato vede ciò che ha salvato."""
+    pending = pending_writes()
+    if not pending:
+        return data
+    invites, guests, rsvps, meals = data
+    guests = list(guests)
+    guest_ids = {g["id"] for g in guests}
+    rsvps_by_guest = {r["guest_id"]: r for r in rsvps}
+    for e in pending:
+        p = e["payload"]
+        if e["worksheet"] == "guests":
+            if p["id"] not in guest_ids:
+                guests.append(p)
+                guest_ids.add(p["id"])
+        elif e["worksheet"] == "rsvps":
+            rsvps_by_guest[p["guest_id"]] = {
+                "guest_id": p["guest_id"],
+                "attending": p.get("attending"),
+                "meal_choice": p.get("meal_choice"),
+                "allergies": p.get("allergies"),
+                "notes": p.get("notes"),
+                "updated_at": p.get("updated_at") or "",
+            }
+    return invites, guests, list(rsvps_by_guest.values()), meals
+
+
+def pending_writes() -> List[Dict[str, Any]]:
+    """Scritture in coda non ancora su Sheets, in ordine di arrivo (sola lettura, non avvia il worker)."""
+    return _get_queue().pending()
+
+
+def queue_status() -> Dict[str, Any]:
+    """Profondità e ritardo della coda di scritture (vista admin)."""
+    return _get_queue().stats()
+
+
+def failed_writes() -> List[Dict[str, Any]]:
+    """Scritture scartate dopo troppi errori non transitori (dead letter)."""
+    return _get_queue().failed()
+
+
+def retry_failed_write(seq: int) -> None:
+    """
+    Riaccoda una scrittura scartata. Le RSVP prendono un nuovo updated_at: con quello
+    vecchio finirebbero sotto il watermark dei delta già esportati e non uscirebbero mai.
+    """
+    queue = _get_queue()
+    entry = next((f for f in queue.failed() if f["seq"] == seq), None)
+    if entry is None:
+        return
+    payload = entry["payload"]
+    if entry["worksheet"] == "rsvps":
+        payload = {**payload, "updated_at": datetime.utcnow().isoformat()}
+    queue.retry_failed(seq, payload)
+
+
+def discard_failed_write(seq: int) -> None:
+    _get_queue().discard_failed(seq)
+
+
+def flush_pending_writes() -> int:
+    """Svuota subito la coda (bloccante). Ritorna quante righe sono state inviate."""
+    sent = _get_queue().drain_once()
+    if sent:
+        refresh_cache()
+    return sent
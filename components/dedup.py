@@ -0,0 +1,167 @@
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+from itertools import combinations
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+# Blocchi più grandi di così (es. un cognome molto comune + stessa iniziale) vengono
+# saltati: evitano che il confronto torni quadratico. Fanno eccezione i nomi identici.
+MAX_BLOCK_SIZE = 50
+DEFAULT_THRESHOLD = 0.85
+
+
+def name_tokens(full_name: str) -> List[str]:
+    """
+    Normalizza un nome in token confrontabili:
+    - rimuove accenti (Mário -> mario)
+    - minuscolo, solo lettere/cifre
+    - ordine dei token ignorato altrove (Rossi Mario == Mario Rossi)
+    """
+    s = unicodedata.normalize("NFKD", full_name or "")
+    s = "".join(c for c in s if not unicodedata.combining(c)).lower()
+    return re.findall(r"[a-z0-9]+", s)
+
+
+def spelling_key(token: str) -> str:
+    """Grafie equivalenti per nomi italiani (h, doppie, y/j/k/w/x); le vocali restano."""
+    t = token.replace("ph", "f").replace("h", "").replace("y", "i").replace("j", "i")
+    t = t.replace("k", "c").replace("w", "v").replace("x", "s")
+    return re.sub(r"(.)\1+", r"\1", t) or token
+
+
+def phonetic_key(token: str) -> str:
+    """
+    Chiave larga, solo per i blocchi: grafia normalizzata senza vocali interne.
+    Raggruppa anche nomi diversi (Luca/Lucia, Mario/Mauro): il punteggio lo decide similarity().
+    """
+    t = spelling_key(token)
+    if len(t) < 3:
+        return t
+    return t[0] + re.sub(r"[aeiou]", "", t[1:-1]) + t[-1]
+
+
+def blocking_keys(tokens: List[str]) -> Set[str]:
+    """
+    Chiavi di blocco: due nomi vengono confrontati solo se condividono almeno una chiave.
+    - token ordinati (ordine nome/cognome, accenti)
+    - chiavi fonetiche ordinate (doppie, h, y/i, vocali interne, ...)
+    - chiave fonetica di un token + iniziale di un altro (M. Rossi, Mraio Rossi)
+    """
+    if not tokens:
+        return set()
+    keys = {"s:" + " ".join(sorted(tokens))}
+    phon = [phonetic_key(t) for t in tokens]
+    keys.add("p:" + " ".join(sorted(phon)))
+    for i, t in enumerate(tokens):
+        if len(t) < 2:
+            continue
+        for j, u in enumerate(tokens):
+            if i != j:
+                keys.add(f"i:{phon[i]}|{u[0]}")
+    return keys
+
+
+def _initials_match(a: List[str], b: List[str]) -> bool:
+    """True se `a` è `b` con qualche nome abbreviato all'iniziale (es. "m rossi" / "mario rossi")."""
+    full_a = sorted(t for t in a if len(t) > 1)
+    initials_a = [t for t in a if len(t) == 1]
+    if not initials_a or len(a) != len(b):
+        return False
+    rest = list(b)
+    for t in full_a:
+        if t not in rest:
+            return False
+        rest.remove(t)
+    return sorted(initials_a) == sorted(t[0] for t in rest)
+
+
+def _differing_tokens(a: List[str], b: List[str]) -> Optional[Tuple[str, str]]:
+    """L'unica coppia di token (grafia normalizzata) che distingue due nomi della stessa lunghezza."""
+    ka, kb = Counter(spelling_key(t) for t in a), Counter(spelling_key(t) for t in b)
+    only_a, only_b = list((ka - kb).elements()), list((kb - ka).elements())
+    if len(a) != len(b) or len(only_a) != 1 or len(only_b) != 1:
+        return None
+    return only_a[0], only_b[0]
+
+
+def _transposed(x: str, y: str) -> bool:
+    """True se y è x con due lettere adiacenti scambiate (Mraio/Mario)."""
+    diff = [i for i, (p, q) in enumerate(zip(x, y)) if p != q]
+    return len(x) == len(y) and len(diff) == 2 and diff[1] == diff[0] + 1 and x[diff[0]] == y[diff[1]] and x[diff[1]] == y[diff[0]]
+
+
+def _consonants(t: str) -> str:
+    return re.sub(r"[aeiou]", "", t)
+
+
+def similarity(a: List[str], b: List[str]) -> Tuple[float, str]:
+    """Punteggio 0..1 e motivo del match tra due nomi già tokenizzati."""
+    sa, sb = " ".join(sorted(a)), " ".join(sorted(b))
+    if sa == sb:
+        return 1.0, "stesso nome"
+    if sorted(spelling_key(t) for t in a) == sorted(spelling_key(t) for t in b):
+        return 0.95, "fonetico"
+    if _initials_match(a, b) or _initials_match(b, a):
+        return 0.9, "iniziale"
+    diff = _differing_tokens(a, b)
+    if diff is None:
+        return SequenceMatcher(None, sa, sb).ratio(), "simile"
+    x, y = diff
+    if _transposed(x, y):
+        return 0.9, "lettere scambiate"
+    if _consonants(x) == _consonants(y):
+        # cambiano solo le vocali: Mario/Maria, Luca/Lucia, Marco/Mirco sono persone diverse
+        return 0.5, "variante (probabilmente persone diverse)"
+    # il resto del nome è uguale: conta solo quanto si somiglia il token diverso
+    return SequenceMatcher(None, x, y).ratio(), "simile"
+
+
+def find_duplicates(
+    guests: List[Dict[str, Any]],
+    invites: Optional[List[Dict[str, Any]]] = None,
+    threshold: float = DEFAULT_THRESHOLD,
+) -> List[Dict[str, Any]]:
+    """
+    Coppie di ospiti probabilmente duplicati, ordinate per punteggio.
+    Si confrontano solo i nomi che condividono una chiave di blocco, quindi il costo
+    cresce con la dimensione dei blocchi e non con n².
+    """
+    labels = {i["id"]: i.get("label") or "" for i in (invites or [])}
+    tokens = {g["id"]: name_tokens(g.get("full_name", "")) for g in guests}
+    by_id = {g["id"]: g for g in guests}
+
+    blocks: Dict[str, List[str]] = defaultdict(list)
+    for gid, toks in tokens.items():
+        for key in blocking_keys(toks):
+            blocks[key].append(gid)
+
+    seen: Set[Tuple[str, str]] = set()
+    pairs = []
+    for key, ids in blocks.items():
+        # i blocchi "stesso nome" si confrontano sempre: ogni coppia è un duplicato vero
+        if len(ids) < 2 or (len(ids) > MAX_BLOCK_SIZE and not key.startswith("s:")):
+            continue
+        for a, b in combinations(ids, 2):
+            pair = (a, b) if a < b else (b, a)
+            if pair in seen:
+                continue
+            seen.add(pair)
+            score, reason = similarity(tokens[a], tokens[b])
+            if score < threshold:
+                continue
+            ga, gb = by_id[pair[0]], by_id[pair[1]]
+            pairs.append({
+                "score": round(score, 3),
+                "reason": reason,
+                "guest_id_a": ga["id"],
+                "full_name_a": ga.get("full_name", ""),
+                "invite_a": labels.get(ga.get("invite_id"), ""),
+                "guest_id_b": gb["id"],
+                "full_name_b": gb.get("full_name", ""),
+                "invite_b": labels.get(gb.get("invite_id"), ""),
+                "same_invite": ga.get("invite_id") == gb.get("invite_id"),
+            })
+
+    pairs.sort(key=lambda p: (-p["score"], p["full_name_a"]))
+    return pairs
@@ -1,24 +1,93 @@
+import hashlib
+import time
+
 import bcrypt
 import streamlit as st
 
+# Durata del login admin verificato (secondi). Sovrascrivibile con
+# st.secrets["ADMIN_SESSION_TTL_MIN"] (minuti).
+ADMIN_SESSION_TTL = 60 * 60
+
+_SESSION_KEY = "_admin_auth"
+
+
+def _session_ttl() -> int:
+    try:
+        return int(float(st.secrets.get("ADMIN_SESSION_TTL_MIN", ADMIN_SESSION_TTL / 60)) * 60)
+    except (TypeError, ValueError):
+        return ADMIN_SESSION_TTL
+
+
+def _hash_fingerprint(stored_hash: bytes) -> str:
+    # Lega il login all'hash corrente: se la password viene cambiata, i login in corso decadono
+    return hashlib.sha256(stored_hash).hexdigest()[:16]
+
+
+def _valid_session(stored_hash: bytes) -> bool:
+    auth = st.session_state.get(_SESSION_KEY)
+    if not auth:
+        return False
+    if auth.get("fingerprint") != _hash_fingerprint(stored_hash) or time.time() >= auth.get("expires_at", 0):
+        st.session_state.pop(_SESSION_KEY, None)
+        return False
+    return True
+
+
+def admin_session_valid() -> bool:
+    """True se la sessione ha un login admin verificato e non scaduto (nessun widget, niente bcrypt)."""
+    return _valid_session(st.secrets["ADMIN_PASSWORD_HASH"].encode())
+
+
+def require_admin_session() -> None:
+    """
+    Da chiamare in cima a ogni fragment admin: i rerun di un fragment non ripassano da
+    admin_login_ok(), quindi se il login è scaduto forzo un rerun completo (che mostra il login).
+    """
+    if not admin_session_valid():
+        st.rerun(scope="app")
+
+
+def admin_logout() -> None:
+    """Invalida il login admin della sessione corrente."""
+    st.session_state.pop(_SESSION_KEY, None)
+
+
 def admin_login_ok() -> bool:
     """
     Login admin "semplice ma decente":
     - password inserita in sidebar
     - confronto con hash bcrypt salvato in secrets
+    - dopo il primo confronto riuscito, in session_state resta il login verificato
+      (impronta dell'hash + scadenza): i rerun successivi non rieseguono bcrypt
+      (lento di proposito)
+    - pulsante "Esci" per invalidare il login
 
     Ritorna True se ok, False altrimenti.
     """
     st.sidebar.subheader("Admin")
+    stored_hash = st.secrets["ADMIN_PASSWORD_HASH"].encode()
+
+    if _valid_session(stored_hash):
+        remaining = int(st.session_state[_SESSION_KEY]["expires_at"] - time.time()) // 60
+        st.sidebar.caption(f"Accesso attivo (scade tra {remaining} min)")
+        if st.sidebar.button("🚪 Esci"):
+            admin_logout()
+            st.rerun()
+        return True
+
     pwd = st.sidebar.text_input("Password admin", type="password")
 
     if not pwd:
         return False
 
-    stored_hash = st.secrets["ADMIN_PASSWORD_HASH"].encode()
     ok = bcrypt.checkpw(pwd.encode(), stored_hash)
 
     if not ok:
         st.sidebar.error("Password errata")
+        return False
 
-    return ok
+    st.session_state[_SESSION_KEY] = {
+        "fingerprint": _hash_fingerprint(stored_hash),
+        "expires_at": time.time() + _session_ttl(),
+    }
+    return True
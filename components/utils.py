@@ -1,4 +1,6 @@
+import os
 import re
+from pathlib import Path
 
 def normalize_code(code: str) -> str:
     """
@@ -13,3 +15,18 @@ def normalize_code(code: str) -> str:
     code = re.sub(r"[^A-Z0-9]", "", code)
     return code
 
+
+def atomic_write_bytes(path: Path, payload: bytes) -> None:
+    """
+    Scrive il file in modo atomico:
+    - scrittura su file temporaneo nella stessa cartella + fsync
+    - os.replace sul file finale (chi legge vede il vecchio o il nuovo, mai a metà)
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
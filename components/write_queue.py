@@ -0,0 +1,323 @@
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# handler(worksheet_batch) -> None: riceve i payload già coalescenti di un worksheet
+BatchHandler = Callable[[List[Dict[str, Any]]], None]
+
+
+def default_is_transient(error: Exception) -> bool:
+    """Errori di rete/timeout: si riprova senza contare verso max_attempts."""
+    return isinstance(error, (ConnectionError, TimeoutError, OSError))
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS writes (
+    seq         INTEGER PRIMARY KEY AUTOINCREMENT,
+    worksheet   TEXT    NOT NULL,
+    key         TEXT    NOT NULL,
+    payload     TEXT    NOT NULL,
+    enqueued_at REAL    NOT NULL,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    permanent_attempts INTEGER NOT NULL DEFAULT 0,
+    last_error  TEXT
+);
+CREATE INDEX IF NOT EXISTS writes_ws_key ON writes (worksheet, key, seq);
+CREATE TABLE IF NOT EXISTS failed (
+    seq         INTEGER PRIMARY KEY,
+    worksheet   TEXT    NOT NULL,
+    key         TEXT    NOT NULL,
+    payload     TEXT    NOT NULL,
+    enqueued_at REAL    NOT NULL,
+    attempts    INTEGER NOT NULL,
+    last_error  TEXT,
+    failed_at   REAL    NOT NULL
+);
+"""
+
+
+class WriteQueue:
+    """
+    Coda di scritture durevole su SQLite con un unico worker in background.
+
+    - enqueue() salva la scrittura su disco e ritorna subito.
+    - Il worker svuota la coda a lotti: per ogni (worksheet, key) vince l'ultima
+      scrittura, e i lotti sono raggruppati per worksheet (una chiamata per foglio).
+    - La coda viene divisa in tratti consecutivi dello stesso worksheet, inviati in
+      ordine di arrivo; se un lotto fallisce ci si ferma e si riprova con backoff
+      esponenziale, così nessuna scrittura più recente scavalca una più vecchia.
+    - Le righe vengono cancellate solo dopo che il lotto è andato a buon fine.
+    - Se un lotto fallisce per un errore non transitorio (dato non valido, bug nel
+      handler) si riprova chiave per chiave: le righe buone passano, quelle che
+      falliscono max_attempts volte finiscono nella tabella `failed` (dead letter)
+      e non bloccano più il worksheet. Si possono riaccodare o scartare dall'admin.
+    - Gli errori transitori (rete, quota) non contano verso max_attempts; nemmeno
+      quelli in cui tutte le chiavi falliscono con lo stesso errore: è il backend
+      a non rispondere, non una riga sbagliata.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        handlers: Dict[str, BatchHandler],
+        on_success: Callable[[], None] = lambda: None,
+        on_error: Callable[[Exception], None] = lambda e: None,
+        debounce: float = 1.0,
+        max_backoff: float = 300.0,
+        max_attempts: int = 5,
+        is_transient: Callable[[Exception], bool] = default_is_transient,
+    ):
+        self.path = Path(path)
+        self.handlers = handlers
+        self.on_success = on_success
+        self.on_error = on_error
+        self.debounce = debounce
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.is_transient = is_transient
+        self._wake = threading.Event()
+        self._drain_lock = threading.Lock()
+        self._worker = None
+        self._start_lock = threading.Lock()
+        self._last_error = None
+        self._last_success_at = None
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(writes)")}
+            if "permanent_attempts" not in columns:  # code create prima della colonna
+                conn.execute("ALTER TABLE writes ADD COLUMN permanent_attempts INTEGER NOT NULL DEFAULT 0")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Una connessione per operazione (thread-safe), commit all'uscita."""
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    # -----------------------------
+    # Produttori
+    # -----------------------------
+    def enqueue(self, worksheet: str, key: str, payload: Dict[str, Any]) -> int:
+        with self._connect() as conn:
+            cur = conn.execute(
+                "INSERT INTO writes (worksheet, key, payload, enqueued_at) VALUES (?, ?, ?, ?)",
+                (worksheet, key, json.dumps(payload, ensure_ascii=False), time.time()),
+            )
+            seq = cur.lastrowid
+        self.start()
+        self._wake.set()
+        return seq
+
+    def pending(self) -> List[Dict[str, Any]]:
+        """Scritture ancora da inviare, in ordine di arrivo."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT seq, worksheet, key, payload FROM writes ORDER BY seq").fetchall()
+        return [{"seq": seq, "worksheet": ws, "key": key, "payload": json.loads(p)} for seq, ws, key, p in rows]
+
+    def stats(self) -> Dict[str, Any]:
+        """Profondità della coda e ritardo della scrittura più vecchia (per la dashboard admin)."""
+        with self._connect() as conn:
+            depth, oldest, max_attempts = conn.execute(
+                "SELECT COUNT(*), MIN(enqueued_at), COALESCE(MAX(attempts), 0) FROM writes"
+            ).fetchone()
+            by_ws = dict(conn.execute("SELECT worksheet, COUNT(*) FROM writes GROUP BY worksheet").fetchall())
+            failed = conn.execute("SELECT COUNT(*) FROM failed").fetchone()[0]
+        return {
+            "depth": depth,
+            "lag_seconds": (time.time() - oldest) if oldest else 0.0,
+            "max_attempts": max_attempts,
+            "by_worksheet": by_ws,
+            "failed": failed,
+            "last_error": self._last_error,
+            "last_success_at": self._last_success_at,
+            "worker_alive": bool(self._worker and self._worker.is_alive()),
+        }
+
+    # -----------------------------
+    # Dead letter
+    # -----------------------------
+    def failed(self) -> List[Dict[str, Any]]:
+        """Scritture scartate dopo max_attempts errori non transitori."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT seq, worksheet, key, payload, attempts, last_error, failed_at FROM failed ORDER BY seq"
+            ).fetchall()
+        return [
+            {"seq": seq, "worksheet": ws, "key": key, "payload": json.loads(p),
+             "attempts": attempts, "last_error": err, "failed_at": failed_at}
+            for seq, ws, key, p, attempts, err, failed_at in rows
+        ]
+
+    def retry_failed(self, seq: int, payload: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Riaccoda una scrittura fallita (in fondo alla coda, tentativi azzerati).
+        Con `payload` la si riaccoda con quel contenuto al posto di quello salvato.
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT worksheet, key, payload FROM failed WHERE seq = ?", (seq,)).fetchone()
+            if row is None:
+                return
+            ws, key, stored = row
+            if payload is not None:
+                stored = json.dumps(payload, ensure_ascii=False)
+            conn.execute("DELETE FROM failed WHERE seq = ?", (seq,))
+            conn.execute(
+                "INSERT INTO writes (worksheet, key, payload, enqueued_at) VALUES (?, ?, ?, ?)",
+                (ws, key, stored, time.time()),
+            )
+        self.start()
+        self._wake.set()
+
+    def discard_failed(self, seq: int) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM failed WHERE seq = ?", (seq,))
+
+    # -----------------------------
+    # Consumatore
+    # -----------------------------
+    def _record_failure(self, ws: str, keys: List[str], max_seq: int, error: Exception, permanent: bool) -> bool:
+        """
+        Incrementa i tentativi; solo gli errori permanenti contano verso max_attempts e
+        spostano in `failed` chi lo ha raggiunto. Ritorna True se tutte le righe delle
+        chiavi sono finite in `failed`.
+        """
+        marks = ",".join("?" * len(keys))
+        where = f"worksheet = ? AND seq <= ? AND key IN ({marks})"
+        params = (ws, max_seq, *keys)
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE writes SET attempts = attempts + 1, permanent_attempts = permanent_attempts + ?, "
+                f"last_error = ? WHERE {where}",
+                (int(permanent), str(error), *params),
+            )
+            if permanent:
+                dead = f"{where} AND permanent_attempts >= ?"
+                conn.execute(
+                    "INSERT INTO failed (seq, worksheet, key, payload, enqueued_at, attempts, last_error, failed_at) "
+                    f"SELECT seq, worksheet, key, payload, enqueued_at, attempts, last_error, ? FROM writes WHERE {dead}",
+                    (time.time(), *params, self.max_attempts),
+                )
+                conn.execute(f"DELETE FROM writes WHERE {dead}", (*params, self.max_attempts))
+            left = conn.execute(f"SELECT COUNT(*) FROM writes WHERE {where}", params).fetchone()[0]
+        return left == 0
+
+    def _delete_sent(self, ws: str, keys: List[str], max_seq: int) -> int:
+        marks = ",".join("?" * len(keys))
+        with self._connect() as conn:
+            cur = conn.execute(
+                f"DELETE FROM writes WHERE worksheet = ? AND seq <= ? AND key IN ({marks})", (ws, max_seq, *keys)
+            )
+            return cur.rowcount
+
+    def _send_worksheet(self, ws: str, by_key: Dict[str, Any], max_seq: int) -> int:
+        """Invia un worksheet; ritorna le righe rimosse, solleva se resta qualcosa in coda."""
+        keys = list(by_key)
+        try:
+            if ws not in self.handlers:
+                raise KeyError(f"nessun handler per il worksheet {ws!r}")
+            self.handlers[ws](list(by_key.values()))
+            return self._delete_sent(ws, keys, max_seq)
+        except Exception as e:
+            transient = self.is_transient(e)
+            if transient or len(keys) == 1:
+                if self._record_failure(ws, keys, max_seq, e, permanent=not transient):
+                    return 0  # finita in dead letter: il worksheet non è più bloccato
+                raise
+
+        # Errore non transitorio su un lotto: isolo la riga colpevole chiave per chiave
+        removed, errors = 0, {}
+        for key in keys:
+            try:
+                self.handlers[ws]([by_key[key]])
+            except Exception as e:
+                if self.is_transient(e):
+                    # il backend è caduto a metà: nessuno degli errori visti conta
+                    self._record_failure(ws, [*errors, key], max_seq, e, permanent=False)
+                    raise
+                errors[key] = e
+                continue
+            removed += self._delete_sent(ws, [key], max_seq)
+
+        if not errors:
+            return removed
+        first_error = next(iter(errors.values()))
+        if len(errors) == len(keys) and len({(type(e), str(e)) for e in errors.values()}) == 1:
+            # tutte le chiavi, stesso errore: è il foglio/backend, non i dati
+            self._record_failure(ws, keys, max_seq, first_error, permanent=False)
+            raise first_error
+        blocked = [key for key, e in errors.items() if not self._record_failure(ws, [key], max_seq, e, permanent=True)]
+        if blocked:
+            raise errors[blocked[0]]
+        return removed
+
+    def drain_once(self) -> int:
+        """
+        Invia tutto ciò che è in coda in questo momento. Ritorna il numero di righe
+        rimosse; solleva l'eccezione del primo worksheet fallito. Aggiorna lo stato
+        mostrato da stats() sia quando gira il worker sia per un invio manuale.
+        """
+        with self._drain_lock:
+            try:
+                removed = self._drain()
+            except Exception as e:
+                self._last_error = str(e)
+                raise
+            self._last_error = None
+            if removed:
+                self._last_success_at = time.time()
+            return removed
+
+    def _drain(self) -> int:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT seq, worksheet, key, payload FROM writes ORDER BY seq").fetchall()
+        if not rows:
+            return 0
+
+        # Tratti consecutivi dello stesso worksheet, in ordine di arrivo; dentro un tratto
+        # per ogni key resta l'ultima scrittura (coalescing)
+        runs: List[Tuple[str, Dict[str, Any], int]] = []
+        for seq, ws, key, payload in rows:
+            if not runs or runs[-1][0] != ws:
+                runs.append((ws, {}, seq))
+            runs[-1][1][key] = json.loads(payload)
+            runs[-1] = (ws, runs[-1][1], seq)
+
+        removed = 0
+        for ws, by_key, max_seq in runs:
+            removed += self._send_worksheet(ws, by_key, max_seq)
+        return removed
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._worker and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._run, name="write-queue", daemon=True)
+            self._worker.start()
+            self._wake.set()  # svuota subito ciò che era rimasto in coda prima di un riavvio
+
+    def _run(self) -> None:
+        backoff = 0.0
+        while True:
+            self._wake.wait(timeout=30.0)
+            self._wake.clear()
+            time.sleep(self.debounce)  # raccoglie i salvataggi ravvicinati nello stesso lotto
+            try:
+                if self.drain_once():
+                    self.on_success()
+                backoff = 0.0
+            except Exception as e:
+                self.on_error(e)
+                backoff = min(max(backoff * 2, 2.0), self.max_backoff)
+                time.sleep(backoff)
+                self._wake.set()
@@ -1,5 +1,4 @@
 import streamlit as st
-import pandas as pd
 
 from components import data_store
 from components.utils import normalize_code
@@ -46,8 +45,16 @@ def fetch_invite_bundle(invite_code: str):
     rsvps_by_guest = {r["guest_id"]: r for r in rsvps_all if r["guest_id"] in {g["id"] for g in guests}}
     return inv, guests, rsvps_by_guest
 
+WIDGET_PREFIXES = ("att_", "meal_", "all_", "notes_")
+
+
 def reload_bundle():
     """Ricarica da DB e salva tutto in session_state."""
+    # Azzero lo stato dei widget: verrà reinizializzato dai dati appena caricati
+    for g in st.session_state.get("guests", []):
+        for prefix in WIDGET_PREFIXES:
+            st.session_state.pop(f"{prefix}{g['id']}", None)
+
     inv, guests, rsvps_by_guest = fetch_invite_bundle(code)
     st.session_state.invite = inv
     st.session_state.guests = guests
@@ -80,190 +87,201 @@ guests = st.session_state.guests
 rsvps_by_guest = st.session_state.rsvps_by_guest
 
 st.success(f"Invito trovato ✅ — **{inv.get('label', 'Il tuo invito')}**")
+if data_store.is_degraded():
+    st.warning("Il nostro archivio online è momentaneamente lento: le risposte vengono salvate e inviate appena possibile.")
 st.caption("Puoi salvare ora e modificare più tardi riaprendo lo stesso link/QR.")
 
 # -----------------------------
 # 4) Carico opzioni menù
 # -----------------------------
-meal_opts = [m for m in data_store.load_meal_options() if m.get("active")]
+_, _, _, meals_all = data_store.load_all_data()
+meal_opts = [m for m in meals_all if m.get("active")]
 meal_label_to_code = {m["label"]: m["code"] for m in meal_opts}
 meal_code_to_label = {m["code"]: m["label"] for m in meal_opts}
 meal_labels = list(meal_label_to_code.keys()) if meal_label_to_code else ["Menù unico"]
 
 
+def _md_cell(value) -> str:
+    return str(value or "").replace("|", "\\|").replace("\n", " ")
+
+
 def render_summary():
-    """Riepilogo presenze/menù in formato tabellare."""
-    rows = []
+    """
+    Riepilogo presenze/menù in formato tabellare.
+    Tabella markdown e non st.dataframe: quest'ultimo importa pandas a ogni rerun.
+    """
+    lines = ["| Nome | Presenza | Menù | Allergie | Note |", "|---|---|---|---|---|"]
     for g in guests:
         prev = rsvps_by_guest.get(g["id"], {})
         att = prev.get("attending")
         att_txt = "In attesa" if att is None else ("Sì" if att else "No")
         meal_txt = meal_code_to_label.get(prev.get("meal_choice"), "") if att is True else ""
 
-        rows.append({
-            "Nome": g["full_name"],
-            "Presenza": att_txt,
-            "Menù": meal_txt,
-            "Allergie": prev.get("allergies") or "",
-            "Note": prev.get("notes") or ""
-        })
+        cells = [g["full_name"], att_txt, meal_txt, prev.get("allergies"), prev.get("notes")]
+        lines.append("| " + " | ".join(_md_cell(c) for c in cells) + " |")
 
     st.subheader("Riepilogo")
-    st.dataframe(pd.DataFrame(rows), use_container_width=True)
+    st.markdown("\n".join(lines))
     st.info("Vuoi modificare? Torna su **Conferma**, cambia e premi **Salva**.")
 
-# -----------------------------
-# 5) Azioni rapide (UX nuclei)
-# -----------------------------
-st.divider()
-st.subheader("Azioni rapide")
+ATT_OPTIONS = ["Non so ancora", "Sì", "No"]
 
-a1, a2, a3 = st.columns(3)
 
-with a1:
-    if st.button("Imposta tutti: Sì"):
-        for g in guests:
-            st.session_state[f"att_{g['id']}"] = "Sì"
+def init_widget_state():
+    """
+    Valori iniziali dei widget presi dal DB, impostati una sola volta per invito.
+    I widget usano solo la key (niente index/value), così le azioni rapide possono
+    modificarli via session_state senza conflitti.
+    """
+    for g in guests:
+        prev = rsvps_by_guest.get(g["id"], {})
+        default_att = "Non so ancora"
+        if prev.get("attending") is True:
+            default_att = "Sì"
+        elif prev.get("attending") is False:
+            default_att = "No"
+        prev_label = meal_code_to_label.get(prev.get("meal_choice"))
 
-with a2:
-    if st.button("Imposta tutti: No"):
-        for g in guests:
-            st.session_state[f"att_{g['id']}"] = "No"
+        st.session_state.setdefault(f"att_{g['id']}", default_att)
+        st.session_state.setdefault(f"meal_{g['id']}", prev_label if prev_label in meal_labels else meal_labels[0])
+        st.session_state.setdefault(f"all_{g['id']}", prev.get("allergies") or "")
+        st.session_state.setdefault(f"notes_{g['id']}", prev.get("notes") or "")
 
-with a3:
-    if st.button("Copia menù sul gruppo"):
-        # copia il menù dal primo "Sì" trovato agli altri "Sì"
-        first_meal = None
-        for g in guests:
-            if st.session_state.get(f"att_{g['id']}") == "Sì":
-                first_meal = st.session_state.get(f"meal_{g['id']}")
-                break
-        if first_meal:
-            for g in guests:
-                if st.session_state.get(f"att_{g['id']}") == "Sì":
-                    st.session_state[f"meal_{g['id']}"] = first_meal
-        else:
-            st.warning("Seleziona prima almeno un 'Sì' e un menù per qualcuno.")
 
-st.divider()
+def collect_rows():
+    """Righe rsvps costruite dai valori (già inviati dal form) in session_state."""
+    rows = []
+    for g in guests:
+        attending = st.session_state[f"att_{g['id']}"]
+        meal = st.session_state[f"meal_{g['id']}"]
+        rows.append({
+            "guest_id": g["id"],
+            "attending": None if attending == "Non so ancora" else (attending == "Sì"),
+            "meal_choice": meal_label_to_code.get(meal) if attending == "Sì" else None,
+            "allergies": st.session_state[f"all_{g['id']}"].strip() or None,
+            "notes": st.session_state[f"notes_{g['id']}"].strip() or None
+        })
+    return rows
+
 
 # -----------------------------
-# 6) Tabs: Conferma / Riepilogo
+# 5) Callback dei pulsanti del form
+#    Girano prima del rerun, quando il form ha già scritto i valori in session_state:
+#    le azioni rapide modificano solo lo stato locale, senza chiamate al backend.
 # -----------------------------
-tab1, tab2 = st.tabs(["📝 Conferma", "📌 Riepilogo"])
+def on_set_all(value: str):
+    for g in guests:
+        st.session_state[f"att_{g['id']}"] = value
 
-updated_rows = []
 
-with tab1:
-    st.write("Conferma per ogni persona e premi **Salva** in fondo.")
-    completed = 0
+def on_copy_meal():
+    # copia il menù dal primo "Sì" trovato agli altri "Sì"
+    yes_ids = [g["id"] for g in guests if st.session_state.get(f"att_{g['id']}") == "Sì"]
+    if not yes_ids:
+        st.session_state.rsvp_flash = ("warning", "Seleziona prima almeno un 'Sì' e un menù per qualcuno.")
+        return
+    first_meal = st.session_state.get(f"meal_{yes_ids[0]}")
+    for gid in yes_ids:
+        st.session_state[f"meal_{gid}"] = first_meal
 
-    for g in guests:
-        prev = rsvps_by_guest.get(g["id"], {})
 
-        st.markdown(f"### {g['full_name']}" + (" 👶" if g.get("is_child") else ""))
+def on_save(show_summary: bool):
+    for row in collect_rows():
+        data_store.upsert_rsvp(row)
+    reload_bundle()
+    st.session_state.go_summary = show_summary
+    st.session_state.rsvp_flash = ("success", "Salvato ✅" if show_summary else "RSVP salvata ✅")
+    st.session_state.rsvp_full_rerun = True
 
-        # default radio da DB
-        default_att = "Non so ancora"
-        if prev.get("attending") is True:
-            default_att = "Sì"
-        elif prev.get("attending") is False:
-            default_att = "No"
 
-        attending = st.radio(
-            "Presenza",
-            ["Non so ancora", "Sì", "No"],
-            index=["Non so ancora","Sì","No"].index(st.session_state.get(f"att_{g['id']}", default_att)),
-            key=f"att_{g['id']}",
-            horizontal=True
-        )
-
-        meal = None
-        if attending == "Sì":
-            # preselezione menù precedente
-            prev_code = prev.get("meal_choice")
-            prev_label = meal_code_to_label.get(prev_code)
-
-            meal = st.selectbox(
-                "Scelta menù",
-                meal_labels,
-                index=meal_labels.index(prev_label) if prev_label in meal_labels else 0,
-                key=f"meal_{g['id']}"
-            )
-
-        allergies = st.text_area(
-            "Allergie / Intolleranze (se nessuna, lascia vuoto)",
-            value=st.session_state.get(f"all_{g['id']}", prev.get("allergies") or ""),
-            key=f"all_{g['id']}",
-            height=70
-        )
-
-        notes = st.text_area(
-            "Note (accessibilità, passeggini, ecc.)",
-            value=st.session_state.get(f"notes_{g['id']}", prev.get("notes") or ""),
-            key=f"notes_{g['id']}",
-            height=70
-        )
-
-        if attending != "Non so ancora":
-            completed += 1
-
-        updated_rows.append({
-            "guest_id": g["id"],
-            "attending": None if attending == "Non so ancora" else (attending == "Sì"),
-            "meal_choice": meal_label_to_code.get(meal) if (attending == "Sì" and meal) else None,
-            "allergies": allergies.strip() or None,
-            "notes": notes.strip() or None
-        })
+def on_reload():
+    reload_bundle()
+    st.session_state.rsvp_flash = ("info", "Dati ricaricati.")
+    st.session_state.rsvp_full_rerun = True
+
+
+def on_add_guest():
+    new_name = st.session_state.get("plus_one_name", "").strip()
+    if not new_name:
+        return
+    if len(guests) >= int(inv.get("max_guests", 1)):
+        st.session_state.rsvp_flash = ("error", "Hai già raggiunto il numero massimo di persone per questo invito.")
+        return
+    data_store.add_guest(invite_id=inv["id"], full_name=new_name, is_child=False)
+    st.session_state.plus_one_name = ""
+    reload_bundle()
+    st.session_state.rsvp_flash = ("success", "Accompagnatore aggiunto ✅")
+    st.session_state.rsvp_full_rerun = True
+
+
+# -----------------------------
+# 6) Editor del nucleo
+#    Tutti i widget stanno in un unico form dentro un fragment: modificare un campo
+#    non fa rerun, e i pulsanti del form rieseguono solo il fragment.
+# -----------------------------
+@st.fragment
+def rsvp_editor():
+    # Dopo un salvataggio serve un rerun completo (riepilogo e dati fuori dal fragment)
+    if st.session_state.pop("rsvp_full_rerun", False):
+        st.rerun()
+
+    flash = st.session_state.pop("rsvp_flash", None)
+    if flash:
+        getattr(st, flash[0])(flash[1])
+
+    init_widget_state()
+
+    with st.form("rsvp_form", border=False):
+        st.subheader("Azioni rapide")
+        a1, a2, a3 = st.columns(3)
+        with a1:
+            st.form_submit_button("Imposta tutti: Sì", on_click=on_set_all, args=("Sì",))
+        with a2:
+            st.form_submit_button("Imposta tutti: No", on_click=on_set_all, args=("No",))
+        with a3:
+            st.form_submit_button("Copia menù sul gruppo", on_click=on_copy_meal)
 
         st.divider()
+        st.write("Conferma per ogni persona e premi **Salva** in fondo.")
 
-    st.progress(completed / max(len(guests), 1))
-    st.caption(f"Completati: {completed}/{len(guests)}")
+        for g in guests:
+            st.markdown(f"### {g['full_name']}" + (" 👶" if g.get("is_child") else ""))
+            st.radio("Presenza", ATT_OPTIONS, key=f"att_{g['id']}", horizontal=True)
+            st.selectbox("Scelta menù (solo se presente)", meal_labels, key=f"meal_{g['id']}")
+            st.text_area("Allergie / Intolleranze (se nessuna, lascia vuoto)", key=f"all_{g['id']}", height=70)
+            st.text_area("Note (accessibilità, passeggini, ecc.)", key=f"notes_{g['id']}", height=70)
+            st.divider()
+
+        completed = sum(1 for g in guests if st.session_state[f"att_{g['id']}"] != "Non so ancora")
+        st.progress(completed / max(len(guests), 1))
+        st.caption(f"Completati: {completed}/{len(guests)}")
+
+        c1, c2, c3 = st.columns([1, 1, 1])
+        with c1:
+            st.form_submit_button("Salva", type="primary", on_click=on_save, args=(False,))
+        with c2:
+            st.form_submit_button("Salva e mostra il riepilogo", on_click=on_save, args=(True,))
+        with c3:
+            st.form_submit_button("Ricarica dati", on_click=on_reload)
 
     # +1: consentito solo se allow_plus_one = True e non si supera max_guests
     if inv.get("allow_plus_one"):
         st.subheader("➕ Aggiungi accompagnatore")
         st.caption("Questa opzione appare solo se prevista dal tuo invito.")
-        new_name = st.text_input("Nome e cognome accompagnatore")
-
-        if st.button("Aggiungi", disabled=not bool(new_name.strip())):
-            current = len(guests)
-            if current >= int(inv.get("max_guests", 1)):
-                st.error("Hai già raggiunto il numero massimo di persone per questo invito.")
-            else:
-                data_store.add_guest(invite_id=inv["id"], full_name=new_name.strip(), is_child=False)
-                data_store.refresh_cache()
-                st.success("Accompagnatore aggiunto ✅ Ricarico invito…")
-                reload_bundle()
-                st.rerun()
-
-    # Bottoni salva
-    c1, c2, c3 = st.columns([1, 1, 1])
-
-    with c1:
-        if st.button("Salva", type="primary"):
-            for row in updated_rows:
-                data_store.upsert_rsvp(row)
-            data_store.refresh_cache()
-            st.success("RSVP salvata ✅")
-            reload_bundle()
-            st.rerun()
-
-    with c2:
-        if st.button("Salva e mostra il riepilogo"):
-            for row in updated_rows:
-                data_store.upsert_rsvp(row)
-            data_store.refresh_cache()
-            st.success("Salvato ✅")
-            reload_bundle()
-            st.session_state.go_summary = True
-            st.rerun()
-
-    with c3:
-        if st.button("Ricarica dati"):
-            reload_bundle()
-            st.info("Dati ricaricati.")
+        with st.form("plus_one_form", border=False):
+            st.text_input("Nome e cognome accompagnatore", key="plus_one_name")
+            st.form_submit_button("Aggiungi", on_click=on_add_guest)
+
+
+st.divider()
+
+# -----------------------------
+# 7) Tabs: Conferma / Riepilogo
+# -----------------------------
+tab1, tab2 = st.tabs(["📝 Conferma", "📌 Riepilogo"])
+
+with tab1:
+    rsvp_editor()
 
     # Mostra subito il riepilogo dopo l'azione "Salva e vai al riepilogo"
     if st.session_state.get("go_summary"):
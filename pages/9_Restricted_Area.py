@@ -1,11 +1,10 @@
 import streamlit as st
-import pandas as pd
-import plotly.express as px
-import qrcode
+from datetime import datetime
 from io import BytesIO
+from typing import Any, Dict, List, Tuple
 
-from components import data_store
-from components.security import admin_login_ok
+from components import change_feed, data_store, dedup
+from components.security import admin_login_ok, admin_session_valid, require_admin_session
 
 st.title("🔒 Restricted Area")
 
@@ -13,75 +12,138 @@ if not admin_login_ok():
     st.info("Inserisci la password admin nella sidebar.")
     st.stop()
 
+# Import pesanti solo dopo il login (plotly e qrcode dentro le sezioni che li usano)
+import pandas as pd
+
+flash = st.session_state.pop("admin_flash", None)
+if flash:
+    getattr(st, flash[0])(flash[1])
+
 if st.sidebar.button("🔄 Refresh dati"):
     data_store.refresh_cache()
 
 invites, guests, rsvps, meals = data_store.load_all_data()
 
-df_inv = pd.DataFrame(invites)
-df_g   = pd.DataFrame(guests)
-df_r   = pd.DataFrame(rsvps)
-df_m   = pd.DataFrame(meals)
-
-for col in ["created_at", "updated_at"]:
-    if col not in df_inv.columns:
-        df_inv[col] = ""
-
-if df_inv.empty:
-    st.warning("Nessun invito nel DB. Importa da CSV o usa seed_demo.")
-    st.stop()
-
-meal_map = dict(zip(df_m["code"], df_m["label"])) if not df_m.empty else {}
-
-# Dataset “ospiti arricchito”
-df = df_g.merge(df_inv, left_on="invite_id", right_on="id", suffixes=("_guest","_invite"))
-if not df_r.empty:
-    df = df.merge(df_r, left_on="id_guest", right_on="guest_id", how="left")
-else:
-    df["attending"] = None
-    df["meal_choice"] = None
-    df["allergies"] = None
-    df["notes"] = None
-
-df["meal_label"] = df["meal_choice"].map(meal_map)
+status_info = data_store.backend_status()
+if status_info["degraded"]:
+    st.warning(
+        f"Google Sheets non raggiungibile: dati dallo snapshot locale del {status_info['snapshot_at']} "
+        f"(sola lettura, {status_info['pending_writes']} scritture in coda)."
+    )
 
-# KPI
-total = len(df)
-yes = int((df["attending"] == True).sum())
-no  = int((df["attending"] == False).sum())
-unk = int(df["attending"].isna().sum())
+with st.sidebar.expander("📨 Coda scritture RSVP"):
+    q = data_store.queue_status()
+    st.metric("In coda", q["depth"])
+    st.metric("Ritardo più vecchia", f"{q['lag_seconds']:.0f} s")
+    if q["by_worksheet"]:
+        st.write(q["by_worksheet"])
+    if q["last_error"]:
+        st.error(f"Ultimo errore (tentativi: {q['max_attempts']}): {q['last_error']}")
+    if not q["worker_alive"]:
+        st.warning("Worker non attivo.")
+    if st.button("Invia ora", disabled=q["depth"] == 0):
+        try:
+            sent = data_store.flush_pending_writes()
+            st.success(f"Inviate {sent} scritture ✅")
+        except Exception as e:
+            st.error(f"Invio fallito: {e}")
+    if q["failed"]:
+        st.error(f"Scritture scartate dopo errori ripetuti: {q['failed']}")
+        for f in data_store.failed_writes():
+            p = f["payload"]
+            st.caption(f"{f['worksheet']} · {p.get('full_name') or p.get('guest_id') or f['key']} — {f['last_error']}")
+            r1, r2 = st.columns(2)
+            if r1.button("Riprova", key=f"retry_failed_{f['seq']}"):
+                data_store.retry_failed_write(f["seq"])
+                st.rerun()
+            if r2.button("Scarta", key=f"discard_failed_{f['seq']}"):
+                data_store.discard_failed_write(f["seq"])
+                st.rerun()
+
+# -----------------------------
+# Dataset condiviso (cache): ricalcolato solo quando cambiano i dati
+# -----------------------------
+@st.cache_data(show_spinner=False)
+def build_enriched(
+    invites: List[Dict[str, Any]],
+    guests: List[Dict[str, Any]],
+    rsvps: List[Dict[str, Any]],
+    meals: List[Dict[str, Any]],
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Ritorna (df_inv, df) dove df è il dataset “ospiti arricchito”."""
+    df_inv = pd.DataFrame(invites)
+    df_g   = pd.DataFrame(guests)
+    df_r   = pd.DataFrame(rsvps)
+    df_m   = pd.DataFrame(meals)
+
+    for col in ["created_at", "updated_at"]:
+        if col not in df_inv.columns:
+            df_inv[col] = ""
+
+    if df_inv.empty or df_g.empty:
+        return df_inv, pd.DataFrame()
+
+    meal_map = dict(zip(df_m["code"], df_m["label"])) if not df_m.empty else {}
+
+    df = df_g.merge(df_inv, left_on="invite_id", right_on="id", suffixes=("_guest","_invite"))
+    if not df_r.empty:
+        # updated_at resta quello della RSVP, quello dell'invito diventa updated_at_invite
+        df = df.merge(df_r, left_on="id_guest", right_on="guest_id", how="left", suffixes=("_invite", ""))
+    else:
+        df["attending"] = None
+        df["meal_choice"] = None
+        df["allergies"] = None
+        df["notes"] = None
+
+    df["meal_label"] = df["meal_choice"].map(meal_map)
+    return df_inv, df
+
+
+@st.cache_data(show_spinner=False)
+def to_csv_bytes(df: pd.DataFrame) -> bytes:
+    return df.to_csv(index=False).encode("utf-8")
+
+
+@st.cache_data(show_spinner=False)
+def qr_png(url: str) -> bytes:
+    import qrcode
 
-c1, c2, c3, c4 = st.columns(4)
-c1.metric("Invitati", total)
-c2.metric("Sì", yes)
-c3.metric("No", no)
-c4.metric("In attesa", unk)
+    img = qrcode.make(url)
+    buf = BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
 
-st.divider()
 
-# Filtri
-st.sidebar.subheader("Filtri")
-status = st.sidebar.multiselect("Presenza", ["Sì","No","In attesa"], default=["Sì","No","In attesa"])
-meal_filter = st.sidebar.multiselect("Menù", sorted([m for m in df["meal_label"].dropna().unique()]))
+def status_counts(df: pd.DataFrame) -> Tuple[int, int, int, int]:
+    total = len(df)
+    yes = int((df["attending"] == True).sum())
+    no  = int((df["attending"] == False).sum())
+    unk = int(df["attending"].isna().sum())
+    return total, yes, no, unk
 
-df_f = df.copy()
-map_status = {"Sì": True, "No": False, "In attesa": None}
-allowed = [map_status[s] for s in status]
 
-if None in allowed:
-    df_f = df_f[df_f["attending"].isin([True, False]) | df_f["attending"].isna()]
-else:
-    df_f = df_f[df_f["attending"].isin(allowed)]
+# -----------------------------
+# Sezioni: ognuna è un fragment e, quando l'utente interagisce, riesegue solo se stessa
+# -----------------------------
+@st.fragment
+def kpi_section(df: pd.DataFrame):
+    require_admin_session()
+    total, yes, no, unk = status_counts(df)
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Invitati", total)
+    c2.metric("Sì", yes)
+    c3.metric("No", no)
+    c4.metric("In attesa", unk)
 
-if meal_filter:
-    df_f = df_f[df_f["meal_label"].isin(meal_filter)]
 
-# Tabs admin
-tab1, tab2, tab3 = st.tabs(["📊 Analytics", "📥 Export", "✉️ Inviti (modifica + QR)"])
+@st.fragment
+def analytics_section(df: pd.DataFrame):
+    require_admin_session()
+    import plotly.express as px
 
-with tab1:
     st.subheader("Analytics")
 
+    _, yes, no, unk = status_counts(df)
     s_counts = pd.Series({"Sì": yes, "No": no, "In attesa": unk}).reset_index()
     s_counts.columns = ["Stato", "Conteggio"]
     st.plotly_chart(px.bar(s_counts, x="Stato", y="Conteggio"), use_container_width=True)
@@ -102,14 +164,41 @@ with tab1:
     rows = [{"Allergene": k, "Occorrenze": int(txt.str.contains(k).sum())} for k in keywords]
     st.dataframe(pd.DataFrame(rows).sort_values("Occorrenze", ascending=False), use_container_width=True)
 
-with tab2:
-    st.subheader("Export CSV")
 
-    csv_all = df.to_csv(index=False).encode("utf-8")
-    st.download_button("⬇️ CSV completo", data=csv_all, file_name="rsvp_export_completo.csv", mime="text/csv")
+@st.fragment
+def export_section(df: pd.DataFrame):
+    require_admin_session()
+    # I filtri stanno qui (non in sidebar): i fragment non possono scrivere nella sidebar
+    # e così cambiare un filtro riesegue solo questa sezione.
+    st.subheader("Filtri")
+    f1, f2 = st.columns(2)
+    with f1:
+        status = st.multiselect("Presenza", ["Sì","No","In attesa"], default=["Sì","No","In attesa"])
+    with f2:
+        meal_filter = st.multiselect("Menù", sorted([m for m in df["meal_label"].dropna().unique()]))
+
+    df_f = df
+    map_status = {"Sì": True, "No": False, "In attesa": None}
+    allowed = [map_status[s] for s in status]
+
+    if None in allowed:
+        df_f = df_f[df_f["attending"].isin([a for a in allowed if a is not None]) | df_f["attending"].isna()]
+    else:
+        df_f = df_f[df_f["attending"].isin(allowed)]
 
-    csv_filtered = df_f.to_csv(index=False).encode("utf-8")
-    st.download_button("⬇️ CSV filtrato", data=csv_filtered, file_name="rsvp_export_filtrato.csv", mime="text/csv")
+    if meal_filter:
+        df_f = df_f[df_f["meal_label"].isin(meal_filter)]
+
+    st.subheader("Export CSV")
+
+    st.download_button(
+        "⬇️ CSV completo", data=to_csv_bytes(df), file_name="rsvp_export_completo.csv", mime="text/csv",
+        on_click="ignore",
+    )
+    st.download_button(
+        "⬇️ CSV filtrato", data=to_csv_bytes(df_f), file_name="rsvp_export_filtrato.csv", mime="text/csv",
+        on_click="ignore",
+    )
 
     st.subheader("Vista tabellare (filtrata)")
     st.dataframe(
@@ -117,7 +206,56 @@ with tab2:
         use_container_width=True
     )
 
-with tab3:
+
+def commit_watermark_if_admin(consumer: str, watermark: change_feed.Watermark):
+    # Callback: gira prima del fragment, quindi ricontrollo qui il login
+    if admin_session_valid():
+        change_feed.commit_watermark(consumer, watermark)
+
+
+@st.fragment
+def delta_export_section():
+    require_admin_session()
+    st.subheader("Export incrementale (solo modifiche)")
+    st.caption("Per catering/location: righe cambiate dall'ultimo export dello stesso destinatario.")
+
+    known = sorted(change_feed.load_watermarks())
+    consumer = st.selectbox("Destinatario", known + ["➕ nuovo…"]) if known else "➕ nuovo…"
+    if consumer == "➕ nuovo…":
+        consumer = st.text_input("Nome destinatario", value="" if known else "catering").strip()
+    if not consumer:
+        return
+
+    watermark = change_feed.get_watermark(consumer)
+    rows, new_watermark = change_feed.changes_since(watermark)
+
+    st.write(
+        f"Ultimo export: **{watermark.get('committed_at', 'mai')}** — "
+        f"modifiche da allora: **{len(rows)}**"
+    )
+    if rows:
+        st.dataframe(pd.DataFrame(rows), use_container_width=True)
+
+    d1, d2 = st.columns(2)
+    with d1:
+        st.download_button(
+            "⬇️ CSV delta (aggiorna il watermark)",
+            data=change_feed.to_csv_bytes(rows),
+            file_name=f"{consumer}_delta_{datetime.now():%Y%m%d_%H%M}.csv",
+            mime="text/csv",
+            on_click=commit_watermark_if_admin,
+            args=(consumer, new_watermark),
+            disabled=not rows,
+        )
+    with d2:
+        if st.button("↺ Riparti da zero", key="reset_watermark"):
+            change_feed.reset_watermark(consumer)
+            st.rerun(scope="fragment")
+
+
+@st.fragment
+def invite_editor_section(df_inv: pd.DataFrame):
+    require_admin_session()
     st.subheader("Gestione inviti")
     st.caption("Qui puoi modificare **max_guests** e **allow_plus_one** (e anche label se ti serve).")
 
@@ -136,9 +274,10 @@ with tab3:
         }
     )
 
-    if st.button("💾 Salva modifiche inviti"):
-        # Aggiorno riga per riga (semplice e robusto)
-        for _, row in edited.iterrows():
+    if st.button("💾 Salva modifiche inviti", disabled=status_info["degraded"]):
+        # Aggiorno solo le righe cambiate
+        changed = edited[(edited[["label","max_guests","allow_plus_one"]] != editable[["label","max_guests","allow_plus_one"]]).any(axis=1)]
+        for _, row in changed.iterrows():
             data_store.update_invite({
                 "id": row["id"],
                 "code": row["code"],
@@ -150,13 +289,44 @@ with tab3:
             })
 
         data_store.refresh_cache()
-        st.success("Inviti aggiornati ✅ (premi Refresh dati in sidebar)")
+        st.session_state.admin_flash = ("success", f"Inviti aggiornati ✅ ({len(changed)})")
+        st.rerun(scope="app")  # rerun completo: KPI, export e QR devono vedere i nuovi dati
 
-    st.divider()
+
+@st.cache_data(show_spinner=False)
+def duplicate_pairs(
+    guests: List[Dict[str, Any]], invites: List[Dict[str, Any]], threshold: float
+) -> List[Dict[str, Any]]:
+    return dedup.find_duplicates(guests, invites, threshold=threshold)
+
+
+@st.fragment
+def duplicates_section(guests: List[Dict[str, Any]], invites: List[Dict[str, Any]]):
+    require_admin_session()
+    st.subheader("Possibili ospiti duplicati")
+    st.caption("Stessa persona sotto inviti diversi (o due volte nello stesso) gonfia conteggi e menù per il catering.")
+
+    threshold = st.slider("Soglia di somiglianza", 0.70, 1.00, dedup.DEFAULT_THRESHOLD, 0.01)
+    pairs = duplicate_pairs(guests, invites, threshold)
+
+    if not pairs:
+        st.success("Nessun duplicato trovato ✅")
+        return
+
+    st.warning(f"Coppie candidate: {len(pairs)}")
+    st.dataframe(
+        pd.DataFrame(pairs)[["score","reason","full_name_a","invite_a","full_name_b","invite_b","same_invite"]],
+        use_container_width=True
+    )
+
+
+@st.fragment
+def qr_section(df_inv: pd.DataFrame):
+    require_admin_session()
     st.subheader("Link RSVP + QR")
 
     base_url = st.secrets.get("BASE_URL", "http://localhost:8501")
-    df_codes = edited[["label","code","max_guests","allow_plus_one"]].copy()
+    df_codes = df_inv[["label","code","max_guests","allow_plus_one"]].copy()
     df_codes["rsvp_url"] = df_codes["code"].apply(lambda c: f"{base_url}/RSVP?code={c}")
 
     st.dataframe(df_codes, use_container_width=True)
@@ -168,15 +338,50 @@ with tab3:
 
     st.code(url, language="text")
 
-    img = qrcode.make(url)
-    buf = BytesIO()
-    img.save(buf, format="PNG")
-    buf.seek(0)
-
-    st.image(buf.getvalue(), width=220)
+    png = qr_png(url)
+    st.image(png, width=220)
     st.download_button(
         "⬇️ Scarica QR PNG",
-        data=buf.getvalue(),
+        data=png,
         file_name=f"QR_{row['code']}.png",
-        mime="image/png"
+        mime="image/png",
+        on_click="ignore",
     )
+
+
+# -----------------------------
+# Layout
+# -----------------------------
+df_inv, df = build_enriched(invites, guests, rsvps, meals)
+
+if df_inv.empty:
+    st.warning("Nessun invito nel DB. Importa da CSV o usa seed_demo.")
+    st.stop()
+
+if df.empty:
+    st.info("Nessun ospite ancora associato agli inviti.")
+else:
+    kpi_section(df)
+
+st.divider()
+
+# Tabs admin
+tab1, tab2, tab3, tab4 = st.tabs(["📊 Analytics", "📥 Export", "✉️ Inviti (modifica + QR)", "👥 Duplicati"])
+
+with tab1:
+    if not df.empty:
+        analytics_section(df)
+
+with tab2:
+    if not df.empty:
+        export_section(df)
+    st.divider()
+    delta_export_section()
+
+with tab3:
+    invite_editor_section(df_inv)
+    st.divider()
+    qr_section(df_inv)
+
+with tab4:
+    duplicates_section(guests, invites)
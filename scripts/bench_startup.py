@@ -0,0 +1,125 @@
+"""
+Benchmark del cold start per pagina: ogni misura gira in un processo Python nuovo
+(come dopo un deploy), esegue la pagina con streamlit.testing e riporta:
+  - tempo di import di streamlit
+  - tempo della prima esecuzione della pagina (import dei moduli + script)
+  - quali moduli pesanti ha caricato la pagina (esclusi quelli già importati da streamlit)
+
+La pagina Admin viene misurata fino al login (password non inserita). La pagina RSVP
+due volte: senza codice e con un codice precompilato (come da QR), che carica l'invito
+da uno snapshot di prova e mostra modulo e riepilogo.
+
+Uso:
+  python scripts/bench_startup.py
+  python scripts/bench_startup.py --runs 5 --json bench_startup.json
+"""
+
+import argparse
+import json
+import pickle
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# (nome del caso, pagina, query params)
+CASES = [
+    ("Home", "Home.py", {}),
+    ("Dettagli", "pages/2_Dettagli.py", {}),
+    ("RSVP (senza codice)", "pages/3_RSVP.py", {}),
+    ("RSVP (?code=BENCH)", "pages/3_RSVP.py", {"code": "BENCH"}),
+    ("Admin (login)", "pages/9_Restricted_Area.py", {}),
+]
+HEAVY_MODULES = ["pandas", "plotly", "qrcode", "PIL", "gspread", "google.oauth2"]
+
+# Snapshot di prova: un invito con 4 ospiti, così la RSVP con codice non tocca Google
+_BENCH_DATA = (
+    [{"id": "inv-bench", "code": "BENCH", "label": "Famiglia Bench", "max_guests": 5,
+      "allow_plus_one": True, "created_at": "", "updated_at": ""}],
+    [{"id": f"g-bench-{i}", "invite_id": "inv-bench", "full_name": f"Ospite {i}", "is_child": i == 3}
+     for i in range(4)],
+    [{"guest_id": "g-bench-0", "attending": True, "meal_choice": "carne", "allergies": None,
+      "notes": None, "updated_at": "2000-01-01T00:00:00"}],
+    [{"code": "carne", "label": "Carne", "active": True}, {"code": "veg", "label": "Vegetariano", "active": True}],
+)
+
+_CHILD = """
+import json, os, sys, time
+sys.path.insert(0, {root!r})
+os.environ["WEDDING_DATA_DIR"] = {data_dir!r}
+
+t0 = time.perf_counter()
+import streamlit
+from streamlit.testing.v1 import AppTest
+t1 = time.perf_counter()
+before = set(sys.modules)
+
+at = AppTest.from_file({page!r}, default_timeout=120)
+at.secrets["ADMIN_PASSWORD_HASH"] = "$2b$12$" + "x" * 53
+for k, v in {query!r}.items():
+    at.query_params[k] = v
+at.run()
+t2 = time.perf_counter()
+
+loaded = set(sys.modules) - before
+print(json.dumps({{
+    "streamlit_s": t1 - t0,
+    "page_s": t2 - t1,
+    "errors": [str(e.value) for e in at.exception],
+    "heavy": [m for m in {heavy!r} if m in loaded],
+}}))
+"""
+
+
+def seed_snapshot(data_dir: str) -> None:
+    """Snapshot nel formato di data_store (pickle + versione), senza importare streamlit qui."""
+    payload = {"version": 1, "saved_at": "bench", "data": _BENCH_DATA}
+    (Path(data_dir) / "snapshot.pkl").write_bytes(pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def measure(page: str, query: dict, data_dir: str) -> dict:
+    code = _CHILD.format(
+        root=str(ROOT), data_dir=data_dir, page=str(ROOT / page), query=query, heavy=HEAVY_MODULES
+    )
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Misura il cold start di ogni pagina Streamlit.")
+    parser.add_argument("--runs", type=int, default=3, help="processi per pagina (si usa la mediana)")
+    parser.add_argument("--json", help="salva i risultati in questo file (per confronti nel tempo)")
+    args = parser.parse_args()
+
+    results = {}
+    for name, page, query in CASES:
+        runs = []
+        for _ in range(args.runs):
+            # Cartella dati nuova per ogni processo: cold start vero, con il solo snapshot
+            with tempfile.TemporaryDirectory() as data_dir:
+                seed_snapshot(data_dir)
+                runs.append(measure(page, query, data_dir))
+        results[name] = {
+            "page": page,
+            "streamlit_s": statistics.median(r["streamlit_s"] for r in runs),
+            "page_s": statistics.median(r["page_s"] for r in runs),
+            "heavy": runs[-1]["heavy"],
+            "errors": runs[-1]["errors"],
+        }
+
+    print(f"{'Caso':24} {'streamlit':>10} {'pagina':>10}  moduli pesanti caricati dalla pagina")
+    for name, r in results.items():
+        print(f"{name:24} {r['streamlit_s'] * 1000:8.0f}ms {r['page_s'] * 1000:8.0f}ms  {', '.join(r['heavy']) or '-'}")
+        for err in r["errors"]:
+            print(f"{'':24} ⚠️  {err}")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2), encoding="utf-8")
+        print(f"\nRisultati salvati in: {Path(args.json).resolve()}")
+
+
+if __name__ == "__main__":
+    main()
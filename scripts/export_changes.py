@@ -0,0 +1,53 @@
+"""
+Export incrementale per catering/location: solo le righe di `rsvps` e `guests`
+cambiate dall'ultimo export dello stesso consumatore.
+
+Uso (dalla root del repo, con .streamlit/secrets.toml configurato):
+  python scripts/export_changes.py catering                 # scrive catering_delta_<data>.csv
+  python scripts/export_changes.py catering --out delta.csv
+  python scripts/export_changes.py catering --dry-run       # non aggiorna il watermark
+  python scripts/export_changes.py catering --full          # riparte da zero (export completo)
+
+Il watermark viene salvato in .data/feed_watermarks.json solo dopo aver scritto il file.
+"""
+
+import argparse
+import sys
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from components import change_feed  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export delta di RSVP/ospiti dall'ultimo watermark.")
+    parser.add_argument("consumer", help="nome del destinatario (es. catering, location)")
+    parser.add_argument("--out", help="file CSV di output")
+    parser.add_argument("--dry-run", action="store_true", help="mostra il delta senza aggiornare il watermark")
+    parser.add_argument("--full", action="store_true", help="ignora il watermark salvato")
+    args = parser.parse_args()
+
+    watermark = None if args.full else change_feed.get_watermark(args.consumer)
+    rows, new_watermark = change_feed.changes_since(watermark, fresh=True)
+
+    print(f"Consumatore: {args.consumer}")
+    print(f"Watermark:   {watermark or change_feed.EMPTY_WATERMARK}")
+    print(f"Modifiche:   {len(rows)}")
+
+    if args.dry_run:
+        for r in rows:
+            print(f"  [{r['change']}] {r['full_name']} ({r['invite_label']}) – {r['updated_at']}")
+        return
+
+    out = Path(args.out or f"{args.consumer}_delta_{datetime.now():%Y%m%d_%H%M}.csv")
+    out.write_bytes(change_feed.to_csv_bytes(rows))
+    change_feed.commit_watermark(args.consumer, new_watermark)
+
+    print(f"\nCSV salvato in: {out.resolve()}")
+    print(f"Nuovo watermark: {new_watermark}")
+
+
+if __name__ == "__main__":
+    main()
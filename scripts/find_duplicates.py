@@ -0,0 +1,47 @@
+"""
+Cerca ospiti duplicati in `guests` (es. "Rossi Mario" / "Mario Rossi" / "Mário Rossi").
+
+Uso (dalla root del repo, con .streamlit/secrets.toml configurato):
+  python scripts/find_duplicates.py
+  python scripts/find_duplicates.py --threshold 0.9
+  python scripts/find_duplicates.py --csv duplicati.csv
+
+Esce con codice 1 se trova coppie candidate (utile prima di mandare i numeri al catering).
+"""
+
+import argparse
+import csv
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from components import data_store, dedup  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trova coppie di ospiti probabilmente duplicati.")
+    parser.add_argument("--threshold", type=float, default=dedup.DEFAULT_THRESHOLD, help="punteggio minimo (0..1)")
+    parser.add_argument("--csv", help="salva le coppie in questo file CSV")
+    args = parser.parse_args()
+
+    invites, guests, _, _ = data_store.load_confirmed_data(fresh=True)
+    pairs = dedup.find_duplicates(guests, invites, threshold=args.threshold)
+
+    print(f"Ospiti: {len(guests)} — coppie candidate: {len(pairs)}\n")
+    for p in pairs:
+        same = " (stesso invito)" if p["same_invite"] else ""
+        print(f"{p['score']:.2f} [{p['reason']}] {p['full_name_a']} ({p['invite_a']}) ↔ {p['full_name_b']} ({p['invite_b']}){same}")
+
+    if args.csv and pairs:
+        with open(args.csv, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=list(pairs[0].keys()))
+            writer.writeheader()
+            writer.writerows(pairs)
+        print(f"\nCSV salvato in: {Path(args.csv).resolve()}")
+
+    sys.exit(1 if pairs else 0)
+
+
+if __name__ == "__main__":
+    main()